@@ -1,16 +1,27 @@
 # --- Imports ---
+import asyncio
 import gradio as gr
+import httpx
+import logging
+from groq import APIConnectionError, InternalServerError, RateLimitError
 from langchain_groq import ChatGroq
 from langchain_community.tools.tavily_search import TavilySearchResults # Updated import
-from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
+from langchain_core.messages import HumanMessage, AIMessage, BaseMessage, SystemMessage
 import os
+import re
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from typing import TypedDict, List, Optional, Dict, Sequence
-from langgraph.graph import StateGraph, END
+from dataclasses import dataclass, field
+from typing import Annotated, AsyncIterator, List, Optional, Dict, Sequence, Tuple
+from langgraph.graph import StateGraph, START, END
+from langgraph.graph.message import add_messages
 
 # --- Environment Setup ---
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
@@ -18,103 +29,264 @@ if not TAVILY_API_KEY or not GROQ_API_KEY:
     raise ValueError("API keys for Tavily and Groq must be set in .env file")
 
 # --- Constants ---
-ORDERED_FIELDS = [
+ORDERED_FIELDS = (
     "destination",
     "budget",
     "activities",
     "duration",
     "accommodation",
-]
-
-QUESTIONS_MAP = {
-    "destination": "🌍 Where would you like to travel?",
-    "budget": "💰 What is your budget for this trip?",
-    "activities": "🤸 What kind of activities do you prefer? (e.g., adventure, relaxation, sightseeing)",
-    "duration": "⏳ How many days do you plan to stay?",
-    "accommodation": "🏨 Do you prefer hotels, hostels, or Airbnbs?",
+)
+
+# QUESTIONS[i] asks for ORDERED_FIELDS[i]
+QUESTIONS = (
+    "🌍 Where would you like to travel?",
+    "💰 What is your budget for this trip?",
+    "🤸 What kind of activities do you prefer? (e.g., adventure, relaxation, sightseeing)",
+    "⏳ How many days do you plan to stay?",
+    "🏨 Do you prefer hotels, hostels, or Airbnbs?",
+)
+
+def format_questions(step: int) -> str:
+    """Builds a numbered form asking every question from `step` onwards at once."""
+    numbered = "\n".join(f"{i + 1}. {question}" for i, question in enumerate(QUESTIONS[step:]))
+    return f"Please answer each question on its own line (or separate them with `;`):\n{numbered}"
+
+# Patterns for parsing user replies, compiled once at import
+START_RE = re.compile(r"^\s*start\s*$", re.IGNORECASE)
+ANSWER_SPLIT_RE = re.compile(r"[\n;]+")
+# A list marker like "1." or "2)" only counts when whitespace follows, so "1.5k euros" or "2000." stay intact
+ANSWER_NUMBERING_RE = re.compile(r"^\s*\d+[.)]\s+")
+# Only a whole answer like "5", "5 days", "7 nights" or "about 2 weeks" is rewritten; months, ranges
+# and compound durations are left for the LLM to read as typed
+DURATION_RE = re.compile(r"(?:(?:about|around)\s+)?(\d+)\s*(days?|nights?|weeks?)?", re.IGNORECASE)
+# Only a whole answer that is just an amount and a currency ("$2,500", "1.5k euros", "USD 3000") is rewritten;
+# anything with a qualifier such as "per day", "under" or "per person" keeps its meaning as typed.
+# Decimals take at most two digits, so a dot used as a thousands separator ("2.000 EUR") is never read as 2
+BUDGET_RE = re.compile(
+    r"(?P<prefix>usd|eur|gbp|inr|jpy|aud|cad)?\s*(?P<symbol>[$€£₹¥])?\s*"
+    r"(?P<amount>\d[\d,]*(?:\.\d{1,2})?)\s*(?P<thousands>k\b)?\s*"
+    r"(?P<suffix>usd|eur|gbp|inr|jpy|aud|cad|dollars?|euros?|pounds?|rupees?|yen)?",
+    re.IGNORECASE,
+)
+CURRENCY_ALIASES = {
+    "$": "USD", "dollar": "USD", "dollars": "USD",
+    "€": "EUR", "euro": "EUR", "euros": "EUR",
+    "£": "GBP", "pound": "GBP", "pounds": "GBP",
+    "₹": "INR", "rupee": "INR", "rupees": "INR",
+    "¥": "JPY", "yen": "JPY",
 }
 
+def _parse_budget(budget_match: re.Match) -> Tuple[float, Optional[str]]:
+    """Amount and currency code (None if no currency was given) from a BUDGET_RE match."""
+    currency_token = budget_match.group('symbol') or budget_match.group('prefix') or budget_match.group('suffix')
+    currency = CURRENCY_ALIASES.get(currency_token.lower(), currency_token.upper()) if currency_token else None
+    amount = float(budget_match.group('amount').replace(",", ""))
+    if budget_match.group('thousands'):
+        amount *= 1000
+    return amount, currency
+
+def _normalize_user_info(user_info: Dict[str, str]) -> Dict[str, str]:
+    """Rewrites duration as '<n> days' (or nights) and budget as '<amount> <CURRENCY>' so the LLM doesn't have to.
+
+    Anything else (e.g. 'about a week', '1-2 weeks', '3 months', 'moderate', '$100 per day')
+    is left as the user typed it.
+    """
+    normalized = dict(user_info)
+
+    duration_match = DURATION_RE.fullmatch(user_info.get('duration', '').strip())
+    if duration_match:
+        count = int(duration_match.group(1))
+        unit = (duration_match.group(2) or "day").lower()
+        if unit.startswith("week"):
+            count, unit = count * 7, "day"
+        unit = "night" if unit.startswith("night") else "day"
+        normalized['duration'] = f"{count} {unit}" if count == 1 else f"{count} {unit}s"
+
+    budget_match = BUDGET_RE.fullmatch(user_info.get('budget', '').strip())
+    if budget_match:
+        amount, currency = _parse_budget(budget_match)
+        if currency:
+            normalized['budget'] = f"{int(amount)} {currency}"
+
+    return normalized
+
+def questions_pending(step: Optional[int]) -> bool:
+    """True once START has been typed (step is set) and some questions are still unanswered."""
+    return step is not None and step < len(ORDERED_FIELDS)
+
 INITIAL_MESSAGE = "👋 Welcome! Type `START` to begin planning your travel itinerary."
-START_CONFIRMATION = "🚀 Great! Let's plan your trip. " + QUESTIONS_MAP[ORDERED_FIELDS[0]]
+START_CONFIRMATION = "🚀 Great! Let's plan your trip. " + format_questions(0)
 RESTART_MESSAGE = "✅ Restarted! Type `START` to begin again."
 INVALID_START_MESSAGE = "❗ Please type `START` to begin the travel itinerary process."
 ITINERARY_READY_MESSAGE = "✅ Your travel itinerary is ready!"
+SEARCHING_MESSAGE = "🔎 Searching for ideas and writing your itinerary..."
+
+# Static instructions for the itinerary LLM call, built once and sent as the leading system message
+ITINERARY_SYSTEM_PROMPT = SystemMessage(content="""You are an expert travel planner. Create a detailed and engaging travel itinerary based on the user preferences you are given.
+NOTE :- Do not go over the user budget.
+
+**Your Task:**
+1.  **Interpret Preferences:** Carefully interpret the user's descriptions for budget, activities, and accommodation.
+    * If the budget is descriptive (e.g., 'moderate', 'budget-friendly', 'a bit flexible', 'around $X'), tailor suggestions to match that level for the specific destination. Avoid extreme high-cost or only free options unless explicitly requested. 'Moderate' usually implies a balance of value, comfort, and experiences.
+    * If activities are described generally (e.g., 'mix of famous and offbeat', 'relaxing', 'cultural immersion', 'adventure'), create an itinerary that reflects this. A 'mix' should include popular landmarks and hidden gems. 'Relaxing' should include downtime.
+    * Interpret accommodation descriptions (e.g., 'mid-range', 'cheap but clean', 'boutique hotel') based on typical offerings at the destination.
+2.  **Use Search Results:** Incorporate relevant and specific suggestions from the supporting search results, but *only* if they align with the interpreted user preferences. Do not blindly copy search results.
+3.  **Create a Coherent Plan:** Structure the itinerary logically, often day-by-day. Include suggestions for specific activities, potential dining spots (matching budget), and estimated timings where appropriate.
+4.  **Engaging Tone:** Present the itinerary in an exciting and appealing way.""")
 
 # --- LangChain / LangGraph Components ---
 
 # Initialize models and tools
-llm = ChatGroq(api_key=GROQ_API_KEY, model="llama3-8b-8192")
+# One pooled async client for every Groq call in the process, so TLS handshakes are reused across requests and sessions
+shared_http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+)
+# max_retries=0 turns off the groq SDK's own retries so retrying_llm below is the only backoff layer
+llm = ChatGroq(api_key=GROQ_API_KEY, model="llama3-8b-8192", http_async_client=shared_http_client, max_retries=0)
+# Graph nodes call the LLM through this wrapper, which backs off exponentially on rate limits
+# and on the transient failures the SDK would otherwise have retried (connection errors, timeouts, 5xx)
+retrying_llm = llm.with_retry(
+    retry_if_exception_type=(RateLimitError, APIConnectionError, InternalServerError),
+    wait_exponential_jitter=True,
+    stop_after_attempt=4,
+)
 # Note: TavilySearchResults often works better when integrated as a Langchain Tool
 # but for direct use like this, the previous langchain_tavily.TavilySearch is also fine.
 # Let's use the more standard Tool wrapper approach for better compatibility.
 search_tool = TavilySearchResults(max_results=5, tavily_api_key=TAVILY_API_KEY)
 
+# Search results are trimmed before they go into the itinerary prompt (llama3-8b has an 8192 token context)
+SEARCH_SNIPPET_CHARS = 600
+SEARCH_RESULTS_MAX_CHARS = 4000
+
+# --- Result Caching ---
+# Shared across sessions so repeat trips skip the slow Tavily search (and the LLM call too
+# when the preferences match exactly). Entries expire after a day to keep results fresh.
+CACHE_MAX_SIZE = 1024
+CACHE_TTL_SECONDS = 24 * 60 * 60
+
+search_cache: TTLCache = TTLCache(maxsize=CACHE_MAX_SIZE, ttl=CACHE_TTL_SECONDS)
+itinerary_cache: TTLCache = TTLCache(maxsize=CACHE_MAX_SIZE, ttl=CACHE_TTL_SECONDS)
+
+def _normalize_text(value: Optional[str]) -> str:
+    return " ".join((value or "").lower().split())
+
+# Rough USD rates, only used to pick a budget tier. The currency is part of the cache key as well,
+# so trips in different currencies never share results even when the rates drift.
+APPROX_USD_RATES = {"USD": 1.0, "EUR": 1.1, "GBP": 1.3, "INR": 0.012, "JPY": 0.0067, "AUD": 0.65, "CAD": 0.73}
+
+_LOW_BUDGET_RE = re.compile(r"cheap|budget|low|tight|backpack")
+_HIGH_BUDGET_RE = re.compile(r"luxur|high|premium|splurge|expensive")
+_ACTIVITY_SPLIT_RE = re.compile(r"[,/&]|\band\b")
+
+def _budget_tier(budget: str) -> str:
+    """Buckets a free-text budget into 'low', 'mid' or 'high', suffixed with its currency when one is given."""
+    budget_match = BUDGET_RE.search(budget)
+    if budget_match:
+        amount, currency = _parse_budget(budget_match)
+        usd_amount = amount * APPROX_USD_RATES.get(currency or "USD", 1.0)
+        tier = "low" if usd_amount < 1000 else "mid" if usd_amount < 3000 else "high"
+        return f"{tier} {currency.lower()}" if currency else tier
+    if _LOW_BUDGET_RE.search(budget):
+        return "low"
+    if _HIGH_BUDGET_RE.search(budget):
+        return "high"
+    return "mid"
+
+def _canonical_key(user_info: Dict[str, str]) -> tuple:
+    """Cache key for search results: normalized preferences with the budget bucketed.
+
+    The duration keeps its full text (unit included) so '2 days' and '2 weeks' never share an entry.
+    """
+    activities = sorted(filter(None, (part.strip() for part in _ACTIVITY_SPLIT_RE.split(_normalize_text(user_info.get('activities'))))))
+    return (
+        _normalize_text(user_info.get('destination')),
+        _normalize_text(user_info.get('duration')),
+        _budget_tier(_normalize_text(user_info.get('budget'))),
+        tuple(activities),
+        _normalize_text(user_info.get('accommodation')),
+    )
+
+def _itinerary_key(user_info: Dict[str, str]) -> tuple:
+    """Cache key for itineraries; keeps the exact budget so nobody gets a plan priced for someone else."""
+    return _canonical_key(user_info) + (_normalize_text(user_info.get('budget')),)
 
-# Define the state for our graph
-class AgentState(TypedDict):
-    messages: Sequence[BaseMessage]  # Conversation history
-    user_info: Dict[str, str]      # Collected user preferences
-    missing_fields: List[str]      # Fields still needed
-    search_results: Optional[str]  # Results from Tavily search
-    itinerary: Optional[str]       # Final generated itinerary
 
-# --- Node Functions ---
+# Only the latest messages are kept; the graph itself works from user_info, not the chat history
+MAX_STORED_MESSAGES = 32
 
-def process_user_input(state: AgentState) -> Dict:
-    """Processes the latest user message to update user_info."""
-    last_message = state['messages'][-1]
-    if not isinstance(last_message, HumanMessage):
-        # Should not happen in normal flow, but good safeguard
-        return {}
+def add_recent_messages(left: Sequence[BaseMessage], right: Sequence[BaseMessage]) -> List[BaseMessage]:
+    """add_messages reducer that drops everything but the last MAX_STORED_MESSAGES."""
+    return add_messages(left, right)[-MAX_STORED_MESSAGES:]
 
-    user_response = last_message.content.strip()
-    missing_fields = state.get('missing_fields', [])
-    user_info = state.get('user_info', {})
+def append_messages(state: Dict, *new_messages: BaseMessage) -> None:
+    """Appends to a session's message list in place, trimming it to MAX_STORED_MESSAGES."""
+    messages = state["messages"]
+    messages.extend(new_messages)
+    del messages[:-MAX_STORED_MESSAGES]
 
-    if not missing_fields:
-        # All info gathered, nothing to process here for now
-        # This node is primarily for capturing answers to questions
-        return {}
 
-    # Assume the user is answering the question related to the *first* missing field
-    field_to_update = missing_fields[0]
-    user_info[field_to_update] = user_response
+# Define the state for our graph.
+# Nodes read it by attribute and return dicts of updates; gr.State keeps the same fields as a plain dict.
+@dataclass(slots=True)
+class AgentState:
+    messages: Annotated[List[BaseMessage], add_recent_messages] = field(default_factory=list)  # Recent conversation history; nodes return only new messages
+    user_info: Dict[str, str] = field(default_factory=dict)  # Collected user preferences
+    step: Optional[int] = None                  # Index into ORDERED_FIELDS of the next unanswered question (None until START)
+    search_results: Optional[str] = None        # Results from Tavily search
+    destination_overview: Optional[str] = None  # Quick LLM overview fetched alongside the search
+    itinerary: Optional[str] = None             # Final generated itinerary
 
-    # Remove the field we just got
-    updated_missing_fields = missing_fields[1:]
+# --- Questionnaire Helpers ---
+# Answers are collected directly in the Gradio handler; the graph only runs once every answer is in.
 
-    print(f"--- Processed Input: Field '{field_to_update}' = '{user_response}' ---")
-    print(f"--- Remaining Fields: {updated_missing_fields} ---")
+def process_user_input(state: Dict, user_response: str) -> Dict:
+    """Records the user's answers (one per line) and returns the updated user_info and step."""
+    user_info = state["user_info"]
+    step = state["step"]
 
-    return {"user_info": user_info, "missing_fields": updated_missing_fields}
+    # Answers are given line by line (or ;-separated) in the same order as the questions; drop any "1." style numbering
+    answers = [ANSWER_NUMBERING_RE.sub("", part).strip() for part in ANSWER_SPLIT_RE.split(user_response.strip())]
+    answers = [answer for answer in answers if answer]
+    answers = answers[:len(ORDERED_FIELDS) - step]
+    for offset, answer in enumerate(answers):
+        user_info[ORDERED_FIELDS[step + offset]] = answer
 
-def ask_next_question(state: AgentState) -> Dict:
-    """Adds the next question to the messages list."""
-    missing_fields = state.get('missing_fields', [])
-    if not missing_fields:
-        # Should not be called if no fields are missing, but handle defensively
-        return {"messages": state['messages'] + [AIMessage(content="Something went wrong, no more questions to ask.")]} # type: ignore
+    # Anything left unanswered is asked again in the next turn
+    step += len(answers)
 
-    next_field = missing_fields[0]
-    question = QUESTIONS_MAP[next_field]
+    return {"user_info": _normalize_user_info(user_info), "step": step}
 
-    print(f"--- Asking Question for: {next_field} ---")
-    # Append the new question
-    updated_messages = state['messages'] + [AIMessage(content=question)] # type: ignore
-    return {"messages": updated_messages}
+# --- Node Functions ---
 
+def _compact_search_results(results: list) -> str:
+    """Dedupes results by URL and trims each to a short snippet to keep the itinerary prompt small."""
+    seen_urls = set()
+    snippets = []
+    for doc in results:
+        if isinstance(doc, dict):
+            url, content = doc.get('url'), doc.get('content', '')
+        else:
+            url, content = None, getattr(doc, 'page_content', str(doc)) # Safer access
+        if url:
+            if url in seen_urls:
+                continue
+            seen_urls.add(url)
+        snippets.append(content.strip()[:SEARCH_SNIPPET_CHARS])
+    return "\n---\n".join(snippets)[:SEARCH_RESULTS_MAX_CHARS]
 
-def run_search(state: AgentState) -> Dict:
+
+async def run_search(state: AgentState) -> Dict:
     """Runs Tavily search based on collected user info, handling descriptive terms."""
-    user_info = state['user_info']
-    print("--- Running Search ---")
+    user_info = state.user_info
 
     # Construct a more descriptive query for the search engine
     query_parts = [f"Travel itinerary ideas for {user_info.get('destination', 'anywhere')}"]
     if user_info.get('duration'):
          # Try to clarify duration if it's non-numeric, otherwise use as is
          duration_desc = user_info.get('duration')
-         query_parts.append(f"for about {duration_desc} days.")
+         query_parts.append(f"for about {duration_desc}.")
 
     if user_info.get('budget'):
         # Frame budget as a description
@@ -129,228 +301,311 @@ def run_search(state: AgentState) -> Dict:
         query_parts.append(f"User's accommodation preference is: '{user_info.get('accommodation')}'.")
 
     search_query = " ".join(query_parts)
-    print(f"--- Refined Search Query: {search_query} ---")
+    logger.debug("Search query: %s", search_query)
+
+    cache_key = _canonical_key(user_info)
+    if cache_key in search_cache:
+        logger.debug("Search cache hit for %s", cache_key)
+        return {"search_results": search_cache[cache_key]}
 
     try:
-        results = search_tool.invoke(search_query)
-        # Handle potential result formats (string, list of docs, dict)
+        results = await search_tool.ainvoke(search_query)
+        # Handle potential result formats (list of docs, dict)
         if isinstance(results, list):
-             search_results_str = "\n\n".join([getattr(doc, 'page_content', str(doc)) for doc in results]) # Safer access
+             search_results_str = _compact_search_results(results)
         elif isinstance(results, dict) and 'answer' in results:
              search_results_str = results['answer']
         elif isinstance(results, dict) and 'result' in results: # Another common format
              search_results_str = results['result']
-        else:
+        elif isinstance(results, dict):
              search_results_str = str(results)
+        else:
+             # TavilySearchResults catches its own errors and returns repr(e) as a plain string
+             logger.warning("Search failed: %s", results)
+             return {"search_results": None}
 
-        print(f"--- Search Results Found ---")
+        if not search_results_str:
+             return {"search_results": None}
+
+        # Only successful searches are cached
+        search_cache[cache_key] = search_results_str
         return {"search_results": search_results_str}
     except Exception as e:
-        print(f"--- Search Failed: {e} ---")
-        # Provide a more informative error message if possible
-        error_details = str(e)
-        return {"search_results": f"Search failed or timed out. Details: {error_details}"}
+        logger.warning("Search failed: %s", e)
+        # Left as None so generate_itinerary knows not to cache a plan built without search results
+        return {"search_results": None}
 
 
-def generate_itinerary(state: AgentState) -> Dict:
-    """Generates the final itinerary using the LLM, interpreting flexible user inputs."""
-    user_info = state['user_info']
-    search_results = state.get('search_results', "No search results available.") # Provide default
-    print("--- Generating Itinerary ---")
-
-    # --- Enhanced Prompt ---
-    itinerary_prompt = f"""
-    You are an expert travel planner. Create a detailed and engaging travel itinerary based on the following user preferences:
-    NOTE :- Do not go over the user budget.
-    
-    **User Preferences:**
-    - Destination: {user_info.get('destination', 'Not specified')}
-    - Duration: {user_info.get('duration', 'Not specified')} days
-    - Budget Description: '{user_info.get('budget', 'Not specified')}'
-    - Preferred Activities Description: '{user_info.get('activities', 'Not specified')}'
-    - Preferred Accommodation Description: '{user_info.get('accommodation', 'Not specified')}'
-
-    **Your Task:**
-    1.  **Interpret Preferences:** Carefully interpret the user's descriptions for budget, activities, and accommodation.
-        * If the budget is descriptive (e.g., 'moderate', 'budget-friendly', 'a bit flexible', 'around $X'), tailor suggestions to match that level for the specific destination. Avoid extreme high-cost or only free options unless explicitly requested. 'Moderate' usually implies a balance of value, comfort, and experiences.
-        * If activities are described generally (e.g., 'mix of famous and offbeat', 'relaxing', 'cultural immersion', 'adventure'), create an itinerary that reflects this. A 'mix' should include popular landmarks and hidden gems. 'Relaxing' should include downtime.
-        * Interpret accommodation descriptions (e.g., 'mid-range', 'cheap but clean', 'boutique hotel') based on typical offerings at the destination.
-    2.  **Use Search Results:** Incorporate relevant and specific suggestions from the search results below, but *only* if they align with the interpreted user preferences. Do not blindly copy search results.
-    3.  **Create a Coherent Plan:** Structure the itinerary logically, often day-by-day. Include suggestions for specific activities, potential dining spots (matching budget), and estimated timings where appropriate.
-    4.  **Engaging Tone:** Present the itinerary in an exciting and appealing way.
-
-    **Supporting Search Results:**
-    ```
-    {search_results}
-    ```
-
-    **Generate the Itinerary:**
-    """
-    # --- End of Enhanced Prompt ---
+async def llm_prefetch(state: AgentState) -> Dict:
+    """Fetches a short destination overview from the LLM while the search is still running."""
+    destination = state.user_info.get('destination', 'the destination')
+
+    overview_prompt = (
+        f"In under 120 words, give a practical overview of {destination} for a traveller: "
+        "the main areas to stay in, how to get around, and any local customs or seasonal tips worth knowing."
+    )
 
     try:
-        response = llm.invoke(itinerary_prompt)
-        # Ensure content extraction handles potential variations
-        itinerary_content = getattr(response, 'content', str(response))
+        response = await retrying_llm.ainvoke([HumanMessage(content=overview_prompt)])
+        return {"destination_overview": response.content}
+    except Exception as e:
+        # The overview is only supporting context, so the itinerary can still be generated without it
+        logger.warning("Overview prefetch failed: %s", e)
+        return {"destination_overview": None}
 
-        print("--- Itinerary Generated ---")
 
+async def generate_itinerary(state: AgentState) -> Dict:
+    """Generates the final itinerary using the LLM, interpreting flexible user inputs."""
+    user_info = state.user_info
+    cache_key = _itinerary_key(user_info)
+    if cache_key in itinerary_cache:
+        logger.debug("Itinerary cache hit for %s", cache_key)
+        itinerary_content = itinerary_cache[cache_key]
         final_message = AIMessage(content=f"{ITINERARY_READY_MESSAGE}\n\n{itinerary_content}")
-        # Ensure messages list exists and append correctly
-        updated_messages = list(state.get('messages', [])) + [final_message]
+        return {"itinerary": itinerary_content, "messages": [final_message]}
+
+    search_results = state.search_results or "No search results available." # Provide default
+    destination_overview = state.destination_overview or "No overview available."
+
+    # Only the per-trip details change between requests; the instructions live in ITINERARY_SYSTEM_PROMPT
+    itinerary_request = f"""**User Preferences:**
+- Destination: {user_info.get('destination', 'Not specified')}
+- Duration: {user_info.get('duration', 'Not specified')}
+- Budget Description: '{user_info.get('budget', 'Not specified')}'
+- Preferred Activities Description: '{user_info.get('activities', 'Not specified')}'
+- Preferred Accommodation Description: '{user_info.get('accommodation', 'Not specified')}'
+
+**Destination Overview:**
+{destination_overview}
 
-        return {"itinerary": itinerary_content, "messages": updated_messages}
+**Supporting Search Results:**
+```
+{search_results}
+```"""
+
+    try:
+        # The system prompt is identical on every call, so Groq can reuse the cached prefix
+        response = await retrying_llm.ainvoke([ITINERARY_SYSTEM_PROMPT, HumanMessage(content=itinerary_request)])
+        itinerary_content = response.content
+
+        # Only cache itineraries that were grounded in search results
+        if state.search_results is not None:
+            itinerary_cache[cache_key] = itinerary_content
+
+        final_message = AIMessage(content=f"{ITINERARY_READY_MESSAGE}\n\n{itinerary_content}")
+        return {"itinerary": itinerary_content, "messages": [final_message]}
     except Exception as e:
-        print(f"--- Itinerary Generation Failed: {e} ---")
+        logger.warning("Itinerary generation failed: %s", e)
         error_details = str(e)
         error_message = AIMessage(content=f"Sorry, I encountered an error while generating the itinerary. Details: {error_details}")
-        # Ensure messages list exists and append correctly
-        updated_messages = list(state.get('messages', [])) + [error_message]
-        return {"itinerary": None, "messages": updated_messages}
+        return {"itinerary": None, "messages": [error_message]}
 
 
 
-def should_ask_question_or_search(state: AgentState) -> str:
-    """Determines the next step based on whether all info is collected."""
-    missing_fields = state.get('missing_fields', [])
-    if not missing_fields:
-        print("--- Condition: All info gathered, proceed to search ---")
-        return "run_search"
-    else:
-        print("--- Condition: More info needed, ask next question ---")
-        return "ask_next_question"
+def should_search_or_use_cache(state: AgentState) -> str | List[str]:
+    """Skips straight to the itinerary when it is already cached, otherwise searches."""
+    if _itinerary_key(state.user_info) in itinerary_cache:
+        # Itinerary already cached, no need to search again
+        return "generate_itinerary"
+    # Fan out: the search and the overview prefetch run concurrently
+    return ["run_search", "llm_prefetch"]
 
 # --- Build the Graph ---
 
 graph_builder = StateGraph(AgentState)
 
 # Define nodes
-graph_builder.add_node("process_user_input", process_user_input)
-graph_builder.add_node("ask_next_question", ask_next_question)
 graph_builder.add_node("run_search", run_search) # Uses the updated function
+graph_builder.add_node("llm_prefetch", llm_prefetch)
 graph_builder.add_node("generate_itinerary", generate_itinerary)
 
 # Define edges
-graph_builder.set_entry_point("process_user_input")
 graph_builder.add_conditional_edges(
-    "process_user_input",
-    should_ask_question_or_search,
-    {"ask_next_question": "ask_next_question", "run_search": "run_search"}
+    START,
+    should_search_or_use_cache,
+    {
+        "run_search": "run_search",
+        "llm_prefetch": "llm_prefetch",
+        "generate_itinerary": "generate_itinerary",
+    }
 )
-graph_builder.add_edge("ask_next_question", END)
-graph_builder.add_edge("run_search", "generate_itinerary")
+# generate_itinerary waits for both parallel branches to finish
+graph_builder.add_edge(["run_search", "llm_prefetch"], "generate_itinerary")
 graph_builder.add_edge("generate_itinerary", END)
 
-# Compile the graph
-travel_agent_app = graph_builder.compile()
+# Compile the graph once at import; no checkpointer is needed since the session state lives in gr.State
+travel_agent_app = graph_builder.compile(debug=False)
+
+# The longest path is (run_search | llm_prefetch) -> generate_itinerary
+GRAPH_RECURSION_LIMIT = 10
 
 # --- Gradio Interface ---
 
-# Function to handle the conversation logic with LangGraph state
-def handle_user_message(user_input: str, history: List[List[str | None]], current_state_dict: Optional[dict]) -> tuple:
-    user_input_cleaned = user_input.strip().lower()
+def add_chat_turn(history: List[Dict[str, str]], user_input: Optional[str], reply: str) -> None:
+    """Appends the user's message (if any) and the bot reply to the chat in Gradio's messages format."""
+    if user_input is not None:
+        history.append({"role": "user", "content": user_input})
+    history.append({"role": "assistant", "content": reply})
+
+# Function to handle the conversation logic with LangGraph state.
+# It is an async generator so the itinerary can be streamed into the chat as the LLM writes it.
+async def handle_user_message(user_input: str, history: List[Dict[str, str]], current_state_dict: Optional[dict], request: gr.Request) -> AsyncIterator[tuple]:
+    is_start_command = START_RE.match(user_input) is not None
 
     # Initialize state if it doesn't exist (first interaction)
     if current_state_dict is None:
         current_state_dict = {
             "messages": [AIMessage(content=INITIAL_MESSAGE)],
             "user_info": {},
-            "missing_fields": [], # Will be populated if user types START
+            "step": None, # Set to 0 when the user types START
             "search_results": None,
+            "destination_overview": None,
             "itinerary": None,
         }
 
     # Handle START command
-    if user_input_cleaned == "start" and not current_state_dict.get("missing_fields"): # Only start if not already started
-        print("--- Received START ---")
-        current_state_dict["missing_fields"] = list(ORDERED_FIELDS) # Initialize missing fields
+    if is_start_command and not questions_pending(current_state_dict["step"]): # Only start if not already started
+        logger.debug("Received START")
+        current_state_dict["step"] = 0 # Begin with the first question
         current_state_dict["user_info"] = {} # Reset user info
         current_state_dict["messages"] = [AIMessage(content=START_CONFIRMATION)] # type: ignore
-        # No graph execution needed yet, just update state and return the first question
-        history.append([None, START_CONFIRMATION]) # Gradio format needs None for user message here
+        # No graph execution needed yet, just update state and return the questions
+        add_chat_turn(history, None, START_CONFIRMATION)
 
     # Handle case where user types something other than START initially
-    elif not current_state_dict.get("missing_fields") and user_input_cleaned != "start":
-         print("--- Waiting for START ---")
-         current_state_dict["messages"] = current_state_dict["messages"] + [ # type: ignore
+    elif not questions_pending(current_state_dict["step"]) and not is_start_command:
+         logger.debug("Waiting for START")
+         append_messages(
+              current_state_dict,
               HumanMessage(content=user_input),
-              AIMessage(content=INVALID_START_MESSAGE)
-         ]
-         history.append([user_input, INVALID_START_MESSAGE])
+              AIMessage(content=INVALID_START_MESSAGE),
+         )
+         add_chat_turn(history, user_input, INVALID_START_MESSAGE)
 
 
     # Handle user responses after START
-    elif current_state_dict.get("missing_fields") or current_state_dict.get("itinerary"): # Process if questions pending or itinerary just generated
-        print(f"--- User Input: {user_input} ---")
+    elif questions_pending(current_state_dict["step"]) or current_state_dict.get("itinerary"): # Process if questions pending or itinerary just generated
+        logger.debug("User input: %s", user_input)
          # Prevent processing if itinerary was just generated and user typed something else
-        if current_state_dict.get("itinerary") and not current_state_dict.get("missing_fields"):
-             print("--- Itinerary already generated, waiting for START OVER ---")
+        if current_state_dict.get("itinerary") and not questions_pending(current_state_dict["step"]):
+             logger.debug("Itinerary already generated, waiting for START OVER")
              # Optionally add a message like "Type START OVER to begin again."
-             history.append([user_input, "Itinerary generated. Please click 'Start Over' to plan a new trip."])
+             add_chat_turn(history, user_input, "Itinerary generated. Please click 'Start Over' to plan a new trip.")
              # Keep state as is, just update history
-             return history, current_state_dict, ""
-
-
-        # Add user message to state's messages list
-        current_messages = current_state_dict.get("messages", [])
-        current_messages.append(HumanMessage(content=user_input))
-        current_state_dict["messages"] = current_messages
-
-        # Invoke the graph
-        print("--- Invoking Graph ---")
-        # Ensure state keys match AgentState before invoking
-        graph_input_state = AgentState(
-             messages=current_state_dict.get("messages", []),
-             user_info=current_state_dict.get("user_info", {}),
-             missing_fields=current_state_dict.get("missing_fields", []),
-             search_results=current_state_dict.get("search_results"),
-             itinerary=current_state_dict.get("itinerary"),
-        )
-        # Use stream or invoke. Invoke is simpler for this request/response cycle.
-        final_state = travel_agent_app.invoke(graph_input_state)
-        print("--- Graph Execution Complete ---")
-
-        # Update the state dictionary from the graph's final state
-        current_state_dict.update(final_state)
+             yield history, current_state_dict, ""
+             return
+
+
+        # Add user message to state's messages list and record the answers it contains
+        append_messages(current_state_dict, HumanMessage(content=user_input))
+        current_state_dict.update(process_user_input(current_state_dict, user_input))
+
+        # Still missing answers: ask for the rest without running the graph
+        if questions_pending(current_state_dict["step"]):
+            question = format_questions(current_state_dict["step"])
+            append_messages(current_state_dict, AIMessage(content=question))
+            add_chat_turn(history, user_input, question)
+            yield history, current_state_dict, ""
+            return
+
+        # Everything is answered, so invoke the graph for the search and itinerary
+        logger.debug("Invoking graph")
+        # The session dict already has every AgentState field, so it is passed as-is; nodes only return
+        # the new messages and the add_messages reducer appends them.
+        # Stream graph events so the itinerary tokens reach the chat as soon as Groq produces them
+        add_chat_turn(history, user_input, "")
+        final_state = None
+        partial_itinerary = ""
+        graph_config = {
+            "recursion_limit": GRAPH_RECURSION_LIMIT,
+            "configurable": {"thread_id": request.session_hash},
+        }
+        async for event in travel_agent_app.astream_events(current_state_dict, config=graph_config, version="v2"):
+            kind = event["event"]
+            if kind == "on_chain_start" and event["name"] == "run_search":
+                history[-1]["content"] = SEARCHING_MESSAGE
+                yield history, current_state_dict, ""
+            elif kind == "on_chat_model_stream" and event["metadata"].get("langgraph_node") == "generate_itinerary":
+                partial_itinerary += event["data"]["chunk"].content
+                history[-1]["content"] = partial_itinerary
+                yield history, current_state_dict, ""
+            elif kind == "on_chain_end" and not event["parent_ids"]:
+                # The root run's output is the graph's final state
+                final_state = event["data"]["output"]
+        logger.debug("Graph execution complete")
+
+        if final_state is None:
+            history[-1]["content"] = "Error: No response."
+        else:
+            # Update the state dictionary from the graph's final state
+            current_state_dict.update(final_state)
 
-        # Update Gradio history
-        # The graph adds the AI response(s) to state['messages']
-        # Get the *last* AI message added by the graph
-        ai_response = final_state['messages'][-1].content if final_state['messages'] and isinstance(final_state['messages'][-1], AIMessage) else "Error: No response."
-        history.append([user_input, ai_response])
+            # Update Gradio history
+            # The graph adds the AI response(s) to state['messages']
+            # Get the *last* AI message added by the graph
+            history[-1]["content"] = final_state['messages'][-1].content if final_state['messages'] and isinstance(final_state['messages'][-1], AIMessage) else "Error: No response."
 
 
     # Handle unexpected state (fallback)
     else:
-        print("--- Unexpected State - Resetting ---")
-        history.append([user_input, "Something went wrong. Please type START to begin."])
+        logger.debug("Unexpected state, resetting")
+        add_chat_turn(history, user_input, "Something went wrong. Please type START to begin.")
         current_state_dict = { # Reset state
             "messages": [AIMessage(content=INITIAL_MESSAGE)],
             "user_info": {},
-            "missing_fields": [],
+            "step": None,
             "search_results": None,
+            "destination_overview": None,
             "itinerary": None,
         }
 
 
     # Return updated history, the persistent state dictionary, and clear the input box
-    return history, current_state_dict, ""
+    yield history, current_state_dict, ""
 
 # Function to reset the state (Start Over button)
 def start_over() -> tuple:
-    print("--- Starting Over ---")
+    logger.debug("Starting over")
     initial_state = {
         "messages": [AIMessage(content=RESTART_MESSAGE)],
         "user_info": {},
-        "missing_fields": [],
+        "step": None,
         "search_results": None,
+        "destination_overview": None,
         "itinerary": None,
     }
-    # Gradio history format: List of [user_msg, assistant_msg] pairs
-    initial_history = [[None, RESTART_MESSAGE]]
+    # Gradio history format: list of {"role", "content"} messages
+    initial_history = [{"role": "assistant", "content": RESTART_MESSAGE}]
     return initial_history, initial_state, "" # Return history, state, clear input
 
 
+# --- Client Warm-up ---
+WARMUP_TIMEOUT_SECONDS = 10
+_warmup_started = False
+
+async def warm_up_llm_client() -> None:
+    """Sends one 1-token Groq request per process so the first real user hits a warm connection.
+
+    It runs from the page load event, i.e. on Gradio's own event loop, so the connection it
+    opens in shared_http_client is the one later requests reuse. Tavily is not warmed: its
+    wrapper opens a fresh aiohttp session on every call, so nothing would carry over.
+    Failures are ignored.
+    """
+    global _warmup_started
+    if _warmup_started:
+        return
+    _warmup_started = True
+
+    logger.debug("Warming up Groq client")
+    try:
+        await asyncio.wait_for(
+            llm.bind(max_tokens=1).ainvoke([HumanMessage(content="ping")]),
+            timeout=WARMUP_TIMEOUT_SECONDS,
+        )
+    except Exception as e:
+        logger.debug("Groq client warm-up failed: %s", e)
+
+
 # --- Gradio UI Definition ---
 with gr.Blocks(theme=gr.themes.Soft()) as app:
     gr.Markdown("# 🌍 AI-Powered Travel Itinerary Generator (LangGraph Version)")
@@ -363,9 +618,10 @@ with gr.Blocks(theme=gr.themes.Soft()) as app:
     chatbot = gr.Chatbot(
         label="Travel Bot",
         bubble_full_width=False,
-        value=[[None, INITIAL_MESSAGE]] # Initial message
+        type="messages", # OpenAI-style role/content messages, so turns are appended rather than rebuilt as pairs
+        value=[{"role": "assistant", "content": INITIAL_MESSAGE}] # Initial message
         )
-    user_input = gr.Textbox(label="Your Message", placeholder="Type here...", scale=3)
+    user_input = gr.Textbox(label="Your Message", placeholder="Type here... (Shift+Enter for a new line)", lines=3, scale=3)
     submit_btn = gr.Button("Send", scale=1)
     start_over_btn = gr.Button("Start Over", scale=1)
 
@@ -385,8 +641,14 @@ with gr.Blocks(theme=gr.themes.Soft()) as app:
         inputs=[],
         outputs=[chatbot, agent_state, user_input] # Reset chatbot, state, and clear input
     )
+    # Warm the Groq client as soon as the first visitor opens the page (only runs once per process)
+    app.load(fn=warm_up_llm_client, inputs=None, outputs=None, queue=False)
+
 
+# Handlers are async, so let several sessions run their search/LLM calls concurrently, capped to
+# stay within Groq's rate limits; further requests wait in a bounded queue
+app.queue(default_concurrency_limit=8, max_size=64)
 
 # --- Run the App ---
 if __name__ == "__main__":
-    app.launch(debug=True)# Debug=True provides more logs
+    app.launch(debug=False)